@@ -0,0 +1,351 @@
+"""Tests for scripts/log-aggregator.py."""
+
+import gzip
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+SCRIPT = Path(__file__).resolve().parent.parent / "scripts" / "log-aggregator.py"
+
+
+def load_script():
+    # Registered in sys.modules so ProcessPoolExecutor workers can unpickle _report_range
+    spec = importlib.util.spec_from_file_location("log_aggregator", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["log_aggregator"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+la = load_script()
+
+EPOCH = 1707264000  # 2024-02-07T00:00:00Z
+
+
+def iso(epoch: int) -> str:
+    return la.format_epoch(epoch)
+
+
+def write_json_log(path: Path, records) -> Path:
+    path.write_text("".join(json.dumps(record) + "\n" for record in records))
+    return path
+
+
+def mixed_records(count: int = 3000):
+    """Timed records with error bursts, each error followed by untimed stack frames."""
+    templates = ["db timeout after {} ms", "cache miss for key {}", "upstream {} refused"]
+    for i in range(count):
+        epoch = EPOCH + i * 2
+        if (epoch // 600) % 5 == 2 and i % 3 == 0:
+            yield {"timestamp": iso(epoch), "level": "ERROR",
+                   "message": templates[i % len(templates)].format(i)}
+            for frame in range(3):
+                yield {"level": "ERROR", "message": f"  at frame{frame} in handler{i % 4}"}
+        else:
+            yield {"timestamp": iso(epoch), "level": ("INFO", "DEBUG", "WARN")[i % 3],
+                   "message": f"user {i % 97} GET /api/{i % 13} ok"}
+
+
+def minute_records(minutes: int = 120, spike: int = 90):
+    """50 records a minute with one background error, and 30 errors in the spike minute."""
+    for minute in range(minutes):
+        for i in range(50):
+            epoch = EPOCH + minute * 60 + i
+            if minute == spike and i < 30:
+                yield {"timestamp": iso(epoch), "level": "ERROR", "message": f"db timeout after {i * 7} ms",
+                       "user_id": f"u{i}"}
+            elif i == 0:
+                yield {"timestamp": iso(epoch), "level": "ERROR", "message": f"login failed for user{minute % 7}",
+                       "user_id": "u1"}
+            else:
+                yield {"timestamp": iso(epoch), "level": "INFO", "message": f"GET /api/{i % 5} ok",
+                       "user_id": "u1" if i % 2 else f"u{(minute * 50 + i) % 500}"}
+
+
+def comparable(report):
+    """A report without the sketches (merged summaries) and the input counts."""
+    report = dict(report)
+    report.pop("sketches")
+    report.pop("sources", None)
+    return report
+
+
+# -----------------------------------------------------------------------------
+# Serial vs --jobs
+# -----------------------------------------------------------------------------
+
+def test_untimed_records_at_range_start_are_dated_by_previous_range():
+    records = [
+        {"timestamp": iso(EPOCH), "level": "INFO", "message": "start"},
+        {"level": "ERROR", "message": "frame one"},
+        {"level": "ERROR", "message": "frame two"},
+        {"timestamp": iso(EPOCH + 600), "level": "INFO", "message": "later"},
+    ]
+    serial = la.StreamingReport()
+    for record in records:
+        serial.add(dict(record))
+
+    merged, tail = la.StreamingReport(), la.StreamingReport()
+    merged.add(dict(records[0]))
+    for record in records[1:]:
+        tail.add(dict(record))
+    merged.merge(tail)
+
+    assert list(merged.series.totals) == list(serial.series.totals)
+    assert list(merged.series.errors) == list(serial.series.errors)
+    assert merged.series.errors[0] == 2
+
+
+def test_ranges_merge_to_serial_report(tmp_path, monkeypatch):
+    path = write_json_log(tmp_path / "app.log", mixed_records())
+    monkeypatch.setattr(la, "MIN_RANGE_BYTES", 4096)
+    aggregator = la.LogAggregator()
+    ranges = la.split_ranges(str(path), 64)
+    assert len(ranges) > 10
+
+    serial = aggregator.generate_report(str(path))
+    merged = aggregator.new_report()
+    formats = aggregator.detect_format(str(path))
+    for byte_range in ranges:
+        merged.merge(la._report_range(str(path), byte_range, formats,
+                                      aggregator.parser_options, aggregator.report_options))
+
+    # At most three error templates per interval, so interval summaries are exact
+    assert comparable(merged.to_report()) == comparable(serial)
+
+
+def test_jobs_matches_serial_pass(tmp_path, monkeypatch):
+    path = write_json_log(tmp_path / "app.log", mixed_records())
+    monkeypatch.setattr(la, "MIN_RANGE_BYTES", 4096)
+    aggregator = la.LogAggregator()
+
+    serial = aggregator.generate_report(str(path))
+    parallel = aggregator.generate_report(str(path), jobs=2)
+
+    assert serial["summary"]["total_logs"] == 3000 + 3 * sum(
+        1 for record in mixed_records() if record.get("level") == "ERROR" and "timestamp" in record)
+    assert comparable(parallel) == comparable(serial)
+
+
+@pytest.mark.skipif(la.orjson is None, reason="orjson not installed")
+def test_jobs_uses_parser_settings(tmp_path, monkeypatch):
+    # json accepts Infinity, orjson does not; workers must parse like the parent
+    records = [json.dumps({"timestamp": iso(EPOCH + i), "level": "INFO", "message": f"m {i}"})
+               for i in range(2000)]
+    records[1500] = '{"timestamp": "%s", "level": "ERROR", "message": "inf", "value": Infinity}' % iso(EPOCH)
+    path = tmp_path / "app.log"
+    path.write_text("\n".join(records) + "\n")
+    monkeypatch.setattr(la, "MIN_RANGE_BYTES", 4096)
+    aggregator = la.LogAggregator(fast_json=False)
+
+    serial = aggregator.generate_report(str(path))
+    parallel = aggregator.generate_report(str(path), jobs=2)
+
+    assert serial["summary"]["by_level"].get("ERROR") == 1
+    assert comparable(parallel) == comparable(serial)
+
+
+# -----------------------------------------------------------------------------
+# Levels and templates
+# -----------------------------------------------------------------------------
+
+def test_text_log_levels_are_normalized(tmp_path):
+    path = tmp_path / "app.log"
+    path.write_text("[2024-02-07 10:00:00] WARN: disk at 91%\n"
+                    "[2024-02-07 10:00:01] WARNING: disk at 95%\n"
+                    "[2024-02-07 10:00:02] err: disk full\n"
+                    "[2024-02-07 10:00:03] info: cleanup done\n")
+    report = la.LogAggregator().generate_report(str(path))
+
+    assert report["summary"]["by_level"] == {"WARNING": 2, "ERROR": 1, "INFO": 1}
+    assert report["warnings"]["count"] == 2
+    assert report["errors"]["count"] == 1
+
+
+@pytest.mark.parametrize("fmt, line, level, message", [
+    ("combined", '203.0.113.7 - - [07/Feb/2024:10:00:00 +0000] "GET /api/users HTTP/1.1" 502 120 "-" "curl/8.0"',
+     "ERROR", "GET /api/users 502"),
+    ("combined", '203.0.113.7 - - [07/Feb/2024:10:00:00 +0000] "GET /missing HTTP/1.1" 404 0',
+     "WARNING", "GET /missing 404"),
+    ("syslog3164", "<11>Feb  7 10:00:01 web01 nginx[812]: upstream timed out", "ERROR", "upstream timed out"),
+    ("syslog5424", "<12>1 2024-02-07T10:00:02Z web01 api 812 - - disk usage high", "WARNING", "disk usage high"),
+    ("logfmt", 'time=2024-02-07T10:00:03Z level=warn msg="slow query" duration=2.5s', "WARNING", "slow query"),
+    ("cri", "2024-02-07T10:00:04.123Z stderr F ERROR connection reset", "ERROR", "ERROR connection reset"),
+    ("docker", '{"log":"{\\"level\\":\\"error\\",\\"message\\":\\"boom\\"}\\n","stream":"stderr",'
+               '"time":"2024-02-07T10:00:05Z"}', "ERROR", "boom"),
+    ("json", '{"timestamp":"2024-02-07T10:00:06Z","severity":"WARN","msg":"retrying"}', "WARNING", "retrying"),
+    ("python", "ERROR:app.db:connection lost", "ERROR", "connection lost"),
+])
+def test_builtin_formats_normalize_levels(fmt, line, level, message):
+    log = la.LogAggregator().get_parser(fmt)(line)
+
+    assert (log["level"], log["message"]) == (level, message)
+
+
+def test_mixed_formats_in_one_file(tmp_path):
+    path = tmp_path / "mixed.log"
+    path.write_text('203.0.113.7 - - [07/Feb/2024:10:00:00 +0000] "GET / HTTP/1.1" 200 512\n' * 60
+                    + "time=2024-02-07T10:01:00Z level=error msg=\"pool exhausted\"\n"
+                    + '203.0.113.7 - - [07/Feb/2024:10:02:00 +0000] "POST /login HTTP/1.1" 503 0\n')
+    report = la.LogAggregator().generate_report(str(path))
+
+    assert report["summary"]["by_level"] == {"INFO": 60, "ERROR": 2}
+
+
+def test_templates_group_messages_that_differ_in_parameters(tmp_path):
+    path = write_json_log(tmp_path / "app.log", minute_records(10, spike=5))
+    report = la.LogAggregator().generate_report(str(path))
+
+    assert report["patterns"] == {
+        "GET /api/<*> ok": 461,
+        "db timeout after <*> ms": 30,
+        "login failed for <*>": 9,
+    }
+    assert report["templates"]["distinct"] == 3
+    example = report["templates"]["top"][1]
+    assert example["template"] == "db timeout after <*> ms"
+    assert example["example_parameters"][:2] == [["0"], ["7"]]
+
+
+# -----------------------------------------------------------------------------
+# Series, anomalies and sketches
+# -----------------------------------------------------------------------------
+
+def test_error_spike_is_flagged_with_its_template(tmp_path):
+    path = write_json_log(tmp_path / "app.log", minute_records())
+    anomalies = la.LogAggregator().generate_report(str(path))["anomalies"]
+
+    assert anomalies["intervals"] == 120
+    assert [(a["start"], a["errors"], a["total"]) for a in anomalies["anomalous_intervals"]] == [
+        (iso(EPOCH + 90 * 60), 30, 50)]
+    assert anomalies["anomalous_intervals"][0]["top_templates"] == [
+        {"template": "db timeout after <*> ms", "errors": 30}]
+
+
+def test_records_before_the_series_start_are_kept():
+    series = la.TimeSeries(60)
+    series.add(EPOCH + 3600, False)
+    series.add(EPOCH, True)
+
+    assert series.dropped == 0
+    assert sum(series.totals) == 2
+    assert series.start(0) == EPOCH
+
+
+def test_dimension_sketches_report_heavy_hitters_and_distinct_counts(tmp_path):
+    path = write_json_log(tmp_path / "app.log", minute_records())
+    report = la.LogAggregator(dimensions=("user_id",)).generate_report(str(path))
+    sketch = report["sketches"]["dimensions"]["user_id"]
+
+    users = [record["user_id"] for record in minute_records()]
+    true_distinct = len(set(users))
+    assert sketch["top"][0]["value"] == "u1"
+    assert sketch["top"][0]["min_count"] <= users.count("u1") <= sketch["top"][0]["count"]
+    assert abs(sketch["distinct_estimate"] - true_distinct) <= 3 * sketch["distinct_relative_error"] * true_distinct
+
+
+# -----------------------------------------------------------------------------
+# Inputs
+# -----------------------------------------------------------------------------
+
+def test_rotated_and_compressed_streams_merge_in_time_order(tmp_path):
+    records = list(mixed_records(1200))
+    timed = [record for record in records if "timestamp" in record]
+    logs = tmp_path / "logs"
+    logs.mkdir()
+    # app.log rotated twice (oldest compressed), worker.log interleaved with it
+    app, worker = timed[0::2], timed[1::2]
+    with gzip.open(logs / "app.log.2.gz", "wt") as f:
+        f.writelines(json.dumps(record) + "\n" for record in app[:200])
+    write_json_log(logs / "app.log.1", app[200:400])
+    write_json_log(logs / "app.log", app[400:])
+    write_json_log(logs / "worker.log", worker)
+
+    merged = la.LogAggregator().generate_report([str(logs)])
+    single = la.LogAggregator().generate_report(str(write_json_log(tmp_path / "all.log", timed)))
+
+    assert la.group_rotations(sorted(str(p) for p in logs.iterdir()))[0] == [
+        str(logs / "app.log.2.gz"), str(logs / "app.log.1"), str(logs / "app.log")]
+    assert merged["sources"] == {"files": 4, "streams": 2}
+    assert comparable(merged) == comparable(single)
+
+
+def test_follow_reads_across_rotation_and_truncation(tmp_path):
+    path = tmp_path / "app.log"
+    write_json_log(path, [{"timestamp": iso(EPOCH + i), "level": "INFO", "message": f"m{i}"} for i in range(3)])
+    followed = la.FollowedFile(str(path), la.LogAggregator(), from_start=True)
+    assert [log["message"] for log in followed.poll()] == ["m0", "m1", "m2"]
+
+    # Lines written just before the rename are still read from the old file
+    with open(path, "a") as f:
+        f.write(json.dumps({"level": "ERROR", "message": "m3"}) + "\n")
+        f.write(json.dumps({"level": "ERROR", "message": "m4"}))
+    os.rename(path, tmp_path / "app.log.1")
+    write_json_log(path, [{"level": "INFO", "message": "m5"}])
+    assert [log["message"] for log in followed.poll()] == ["m3", "m4", "m5"]
+
+    # copytruncate
+    path.write_text("")
+    assert list(followed.poll()) == []
+    write_json_log(path, [{"level": "INFO", "message": "m6"}])
+    assert [log["message"] for log in followed.poll()] == ["m6"]
+    followed.close()
+
+
+# -----------------------------------------------------------------------------
+# Indexed store
+# -----------------------------------------------------------------------------
+
+def test_store_indexes_incrementally_and_queries(tmp_path):
+    path = write_json_log(tmp_path / "app.log", minute_records(10, spike=5))
+    store = la.LogStore(str(tmp_path / "logs.db"))
+    aggregator = la.LogAggregator()
+    try:
+        assert store.index_file(str(path), aggregator)["records"] == 500
+        assert store.index_file(str(path), aggregator)["records"] == 0
+
+        # Appended lines are picked up, and a rotated file is not ingested again
+        with open(path, "a") as f:
+            f.write(json.dumps({"timestamp": iso(EPOCH + 900), "level": "ERROR", "message": "db timeout"}) + "\n")
+        assert store.index_file(str(path), aggregator)["records"] == 1
+        os.rename(path, tmp_path / "app.log.1")
+        assert store.index_file(str(tmp_path / "app.log.1"), aggregator)["records"] == 0
+
+        assert store.query(level="error", count_only=True)["count"] == 40
+        timeouts = store.query(match="timeout", since=EPOCH + 5 * 60, until=EPOCH + 6 * 60)
+        assert timeouts["count"] == 30
+        assert {record["level"] for record in timeouts["records"]} == {"ERROR"}
+        assert store.query(match="timeout", limit=5)["count"] == 5
+    finally:
+        store.close()
+
+
+def test_query_rejects_malformed_match(tmp_path):
+    path = write_json_log(tmp_path / "app.log", [{"timestamp": iso(EPOCH), "level": "INFO", "message": "up"}])
+    db = tmp_path / "logs.db"
+    subprocess.run([sys.executable, str(SCRIPT), "index", str(path), "--db", str(db)],
+                   capture_output=True, check=True)
+    result = subprocess.run([sys.executable, str(SCRIPT), "query", "--db", str(db), "--match", "up AND"],
+                            capture_output=True, text=True)
+
+    assert result.returncode == 2
+    assert "invalid --match query" in result.stderr
+
+
+# -----------------------------------------------------------------------------
+# CLI
+# -----------------------------------------------------------------------------
+
+def test_missing_input_is_reported_on_stderr(tmp_path):
+    path = write_json_log(tmp_path / "ok.log", [{"timestamp": iso(EPOCH), "level": "INFO", "message": "up"}])
+    missing = tmp_path / "missing.log"
+    result = subprocess.run([sys.executable, str(SCRIPT), str(path), str(missing)],
+                            capture_output=True, text=True)
+
+    assert json.loads(result.stdout)["summary"]["total_logs"] == 1
+    assert f"File not found: {missing}" in result.stderr